@@ -1,15 +1,21 @@
 # app.py
 
 import base64
+import click
+import hashlib
 import json
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from functools import wraps
 import time
 import jwt
+import orjson
 import requests
 from bs4 import BeautifulSoup
+from cachetools import TTLCache
 from urllib.parse import urlparse, urljoin
 import logging
 from logging.handlers import RotatingFileHandler
@@ -18,49 +24,111 @@ import firebase_admin
 import google.generativeai as genai
 from dotenv import load_dotenv
 from firebase_admin import credentials, firestore
-from flask import Flask, jsonify, request, g, current_app
+from flask import Flask, jsonify, request, g, current_app, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 from google.api_core import exceptions
 
 # --- Module Imports from your project ---
 from web_context_agent import get_routed_web_context 
 from game_generator import generate_game_for_topic
 from story_generator import generate_story_node
-from explore_generator import generate_explanation, generate_quiz_from_text
+from explore_generator import generate_explanation, generate_quiz_from_text, stream_explanation
 from firestore_handler import (
     get_user_profile_data,
     toggle_favorite_status,
     save_streak_to_db,
     save_quiz_attempt_to_db,
-    sanitize_word_for_id
+    sanitize_word_for_id,
+    create_user_account,
+    delete_user_index_entries,
+    find_user_id_by_identifier,
+    is_valid_doc_id,
+    backfill_user_indexes,
+    IdentifierTakenError,
+    PageCursorNotFoundError
 )
 
 load_dotenv()
+# INFO by default; set LOG_LEVEL=DEBUG locally to see prompts and per-doc traces
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 app = Flask(__name__) # The app is created HERE
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Routes jsonify() and request.get_json() through orjson's C encoder/decoder."""
+    def dumps(self, obj, **kwargs):
+        # OPT_NON_STR_KEYS keeps parity with the stdlib encoder for int-keyed dicts
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = OrjsonProvider(app)
+# Accept routes with or without a trailing slash instead of answering with a 308 redirect
+app.url_map.strict_slashes = False
+# Behind the hosting proxy, remote_addr is the proxy itself; set TRUSTED_PROXY_HOPS
+# to the number of proxies in front so per-IP rate-limit buckets are per client.
+# Off by default: without a proxy, any client could spoof X-Forwarded-For.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+app.logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
 CORS(app, resources={r"/*": {"origins": ["https://tiny-tutor-app-frontend1.onrender.com", "http://localhost:5173", "http://127.0.0.1:5173"]}}, supports_credentials=True, expose_headers=["Content-Type", "Authorization"], allow_headers=["Content-Type", "Authorization", "X-Requested-With", "X-User-API-Key"])
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'fallback_secret_key_for_dev_only_change_me')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+# Werkzeug refuses larger bodies with a 413 before anything buffers or parses them.
+# Story history and quiz source text are the largest legitimate payloads.
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 1024 * 1024))
+# The public auth endpoints only ever receive a few short strings.
+MAX_AUTH_BODY_BYTES = 8 * 1024
 
 # --- Firebase Initialization ---
-# (No changes here)
-service_account_key_base64 = os.getenv('FIREBASE_SERVICE_ACCOUNT_KEY_BASE64')
+def _initialize_firebase():
+    """
+    Initializes the Admin SDK from FIREBASE_SERVICE_ACCOUNT_KEY_BASE64 if set, else
+    from Application Default Credentials (GCP runtime, or the local emulator via
+    FIRESTORE_EMULATOR_HOST). The decoded key only lives in this function's
+    locals, so the private key isn't retained at module level after startup.
+    """
+    if firebase_admin._apps:
+        return
+    service_account_key_base64 = os.getenv('FIREBASE_SERVICE_ACCOUNT_KEY_BASE64')
+    if service_account_key_base64:
+        service_account_info = json.loads(base64.b64decode(service_account_key_base64).decode('utf-8'))
+        firebase_admin.initialize_app(credentials.Certificate(service_account_info))
+    else:
+        app.logger.warning("FIREBASE_SERVICE_ACCOUNT_KEY_BASE64 not found; using Application Default Credentials.")
+        firebase_admin.initialize_app()
+
 db = None
-if service_account_key_base64:
-    try:
-        decoded_key_bytes = base64.b64decode(service_account_key_base64)
-        service_account_info = json.loads(decoded_key_bytes.decode('utf-8'))
-        if not firebase_admin._apps:
-            cred = credentials.Certificate(service_account_info)
-            firebase_admin.initialize_app(cred)
-        db = firestore.client()
-        app.logger.info("Firebase Admin SDK initialized successfully.")
-    except Exception as e:
-        app.logger.error(f"Failed to initialize Firebase Admin SDK: {e}")
-else:
-    app.logger.warning("FIREBASE_SERVICE_ACCOUNT_KEY_BASE64 not found.")
+users_collection = None
+try:
+    _initialize_firebase()
+    db = firestore.client()
+    # Built once; routes derive per-user document refs from it
+    users_collection = db.collection('users')
+    app.logger.info("Firebase Admin SDK initialized successfully.")
+
+    # The gRPC channel resolves DNS and does the TLS handshake lazily on first use;
+    # do that now in the background so the first real request doesn't pay for it.
+    def _warm_firestore_channel():
+        try:
+            db.collection('_warmup').document('_').get()
+        except Exception as e:
+            app.logger.warning(f"Firestore channel warmup failed: {e}")
+    threading.Thread(target=_warm_firestore_channel, daemon=True).start()
+except Exception as e:
+    app.logger.error(f"Failed to initialize Firebase Admin SDK: {e}")
+
+# Read once at startup rather than from the environment on every request
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
 # --- CORRECTED: Rate Limiter with Bypass ---
 def get_request_identifier():
@@ -71,18 +139,195 @@ def get_request_identifier():
     # Otherwise, key by user_id for logged-in users, or IP for guests
     return g.get("user_id", get_remote_address())
 
-limiter = Limiter(key_func=get_request_identifier, app=app)
+# Shared Redis storage so limits hold across gunicorn workers and instances; the
+# moving-window strategy runs its cleanup+count+insert as one atomic Lua script.
+# Falls back to per-process memory when REDIS_URL is unset (local dev), and
+# temporarily while Redis is unreachable rather than failing every request.
+limiter = Limiter(
+    key_func=get_request_identifier,
+    app=app,
+    storage_uri=os.getenv('REDIS_URL', 'memory://'),
+    storage_options={'socket_connect_timeout': 2, 'socket_timeout': 2, 'health_check_interval': 30},
+    strategy='moving-window',
+    in_memory_fallback_enabled=True
+)
+
+@limiter.request_filter
+def _exempt_preflight():
+    # CORS preflights carry no credentials and never reach a view; don't spend a
+    # limiter round-trip (or a slot of the caller's quota) on them.
+    return request.method == 'OPTIONS'
+
+
+# --- JWT Verification Cache ---
+# Verified (user_id, exp) pairs keyed by a SHA-256 of the raw token (the token
+# itself is never stored), so repeat requests within a session skip the HMAC
+# verify + JSON parse. Entries never outlive the token's own 'exp'.
+_jwt_cache = TTLCache(maxsize=10000, ttl=30)
+_jwt_cache_lock = threading.Lock()
+# Hashes of recently rejected tokens. A token that failed signature or claim checks
+# will fail them again, so replays of the same bad token (stale clients, stuffing)
+# are refused without another decode.
+_bad_jwt_cache = TTLCache(maxsize=4096, ttl=60)
+
+def _verify_token(token):
+    """Returns the token's user_id, raising a jwt exception if it is invalid or expired."""
+    cache_key = hashlib.sha256(token.encode('utf-8')).digest()
+    now = time.time()
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(cache_key)
+        known_bad = cache_key in _bad_jwt_cache
+    if cached and cached[1] > now:
+        return cached[0]
+    if known_bad:
+        raise jwt.InvalidTokenError("Token was recently rejected")
+
+    # Full verification (signature + claims) only happens on a cache miss
+    try:
+        data = jwt.decode(
+            token, app.config['JWT_SECRET_KEY'], algorithms=["HS256"],
+            options={'verify_signature': True, 'require': ['exp', 'user_id']}
+        )
+    except jwt.InvalidTokenError:
+        with _jwt_cache_lock:
+            _bad_jwt_cache[cache_key] = True
+        raise
+    with _jwt_cache_lock:
+        _jwt_cache[cache_key] = (data['user_id'], data['exp'])
+    return data['user_id']
+
+# Basic shape check for signup emails
+MAX_EMAIL_LENGTH = 254
+_EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+# Emails and lowercased usernames double as email_index/username_index document
+# IDs, so signup also checks them with is_valid_doc_id.
+MAX_USERNAME_LENGTH = 64
+
+# --- Password Hashing ---
+# Argon2id tuned to ~50ms per hash. Legacy werkzeug pbkdf2 hashes still verify
+# and are re-hashed with argon2 on the user's next successful login.
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+# Both hash routines run in C and release the GIL, so hashing on a small pool keeps
+# the request thread free to serve other requests meanwhile. Under gevent's
+# monkey-patching this pool's "threads" are greenlets and a hash would block the
+# hub, so there the hashes go to gevent's native threadpool instead.
+_pw_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='pw-hash')
+
+def _gevent_threadpool():
+    """gevent's real-thread pool when threading is monkey-patched, else None."""
+    try:
+        from gevent import get_hub, monkey
+    except ImportError:
+        return None
+    if not monkey.is_module_patched('threading'):
+        return None
+    return get_hub().threadpool
+
+def _run_hash(fn, *args):
+    pool = _gevent_threadpool()
+    if pool is not None:
+        return pool.apply(fn, args)
+    return _pw_pool.submit(fn, *args).result()
+
+# Successful verifications for a short window, keyed by a hash of the stored hash
+# and the submitted password, to absorb client retries and tab reloads. Keying on
+# the stored hash means a password change invalidates the entry.
+_pw_verify_cache = TTLCache(maxsize=2048, ttl=60)
+_pw_verify_cache_lock = threading.Lock()
+
+# Usernames/emails recently found taken at signup, mapped to the 409 message.
+# Retries of a taken identifier (double submits, signup sprays) are refused
+# without the argon2 hash and the Firestore transaction. The cache is per
+# process: account deletion evicts the user's entries in the worker that
+# handled it, while other workers may keep answering 409 until the TTL expires.
+_taken_identifier_cache = TTLCache(maxsize=50000, ttl=60)
+_taken_identifier_cache_lock = threading.Lock()
+
+# User doc fields read by /login
+_LOGIN_FIELDS = ['password_hash', 'username', 'email']
+
+# werkzeug formats that may still be stored from before the argon2 switch
+_LEGACY_HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+# Hashing cost grows with input length; nobody needs a longer password than this
+MAX_PASSWORD_LENGTH = 1024
+
+def _hash_password(password):
+    return _run_hash(_password_hasher.hash, password)
+
+def _check_password(stored_hash, password):
+    if stored_hash.startswith('$argon2'):
+        try:
+            return _password_hasher.verify(stored_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    if stored_hash.startswith(_LEGACY_HASH_PREFIXES):
+        return check_password_hash(stored_hash, password)
+    # Empty or unrecognized hash: nothing can match, so don't spend a hash on it
+    return False
+
+def _verify_password(stored_hash, password):
+    cache_key = hashlib.sha256(f"{stored_hash}|{password}".encode('utf-8')).digest()
+    with _pw_verify_cache_lock:
+        if cache_key in _pw_verify_cache:
+            return True
+
+    is_valid = _run_hash(_check_password, stored_hash, password)
+    if is_valid:
+        with _pw_verify_cache_lock:
+            _pw_verify_cache[cache_key] = True
+    return is_valid
+
+# Verified against when the account doesn't exist, so an unknown username/email
+# takes as long to reject as a wrong password and can't be told apart by timing.
+_DUMMY_PASSWORD_HASH = _password_hasher.hash(os.urandom(16).hex())
+
+def _burn_password_check(password):
+    _run_hash(_check_password, _DUMMY_PASSWORD_HASH, password)
+
+def _password_needs_rehash(stored_hash):
+    return not stored_hash.startswith('$argon2') or _password_hasher.check_needs_rehash(stored_hash)
+
+# Background rehash-on-login writes. Kept apart from the hash pools because each
+# task itself waits on a hash submitted to one of them.
+_rehash_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='pw-rehash')
+
+def _upgrade_password_hash(user_ref, password):
+    try:
+        user_ref.update({'password_hash': _hash_password(password)})
+    except Exception as e:
+        app.logger.error(f"Failed to upgrade password hash for user {user_ref.id}: {e}")
+
+# --- Token Decorators ---
+# Tier of recently seen users, so an authenticated request doesn't need a
+# Firestore read just to authorize. A tier change or account deletion takes
+# effect within the TTL (immediately for deletions handled by this process).
+_user_tier_cache = TTLCache(maxsize=10000, ttl=30)
+_user_tier_cache_lock = threading.Lock()
+
+def _get_user_tier(user_id):
+    """Returns the user's tier, or None if the user no longer exists."""
+    with _user_tier_cache_lock:
+        tier = _user_tier_cache.get(user_id)
+    if tier is not None:
+        return tier
+
+    # Only the tier is needed to authorize the request
+    user_doc = users_collection.document(user_id).get(field_paths=['tier'])
+    if not user_doc.exists:
+        return None
+    tier = user_doc.to_dict().get('tier', 'free')
+    with _user_tier_cache_lock:
+        _user_tier_cache[user_id] = tier
+    return tier
 
-# --- Token Decorators (no changes) ---
 def _get_user_from_token(token):
     try:
-        data = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
-        user_id = data['user_id']
-        user_doc = db.collection('users').document(user_id).get()
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
+        user_id = _verify_token(token)
+        user_tier = _get_user_tier(user_id)
+        if user_tier is not None:
             g.user_id = user_id
-            g.user_tier = user_data.get('tier', 'free')
+            g.user_tier = user_tier
             return user_id
     except Exception:
         return None
@@ -113,9 +358,12 @@ def generation_limit():
         return "200/day"
     return "3/day"
 
+# Identical for every key check, so build it once.
+KEY_VALIDATION_CONFIG = genai.types.GenerationConfig(max_output_tokens=1)
+
 def configure_gemini_for_request():
     user_api_key = request.headers.get('X-User-API-Key')
-    api_key_to_use = user_api_key if user_api_key else os.getenv('GEMINI_API_KEY')
+    api_key_to_use = user_api_key if user_api_key else GEMINI_API_KEY
     if not api_key_to_use:
         raise ValueError("API key is not available.")
     genai.configure(api_key=api_key_to_use)
@@ -123,17 +371,21 @@ def configure_gemini_for_request():
 # ... (add this helper function somewhere in the file, e.g., before the routes)
 def delete_collection(coll_ref, batch_size):
     """Recursively delete a collection in batches."""
-    docs = coll_ref.limit(batch_size).stream()
+    docs = coll_ref.limit(batch_size).select([]).stream()
     deleted = 0
+    # Each page of deletes is committed as one batch rather than a write per doc
+    batch = db.batch()
 
     for doc in docs:
-        print(f"Deleting doc: {doc.id}")
+        app.logger.debug("Deleting doc: %s", doc.id)
         # Recursively delete subcollections
         for sub_coll_ref in doc.reference.collections():
             delete_collection(sub_coll_ref, batch_size)
-        doc.reference.delete()
+        batch.delete(doc.reference)
         deleted += 1
 
+    if deleted:
+        batch.commit()
     if deleted >= batch_size:
         return delete_collection(coll_ref, batch_size)
     
@@ -145,10 +397,15 @@ def ratelimit_handler(e):
     # The frontend will provide the specific message text
     return jsonify(error=f"Rate limit exceeded: {e.description}"), 429
 
+@app.errorhandler(413)
+def request_too_large_handler(e):
+    return jsonify(error="Request body too large"), 413
+
 @app.route('/generate_explanation', methods=['POST'])
 @token_optional
 @limiter.limit(generation_limit)
 def generate_explanation_route(current_user_id):
+    word = ''
     try:
         # 1. Configure Gemini for the request (handles user-provided keys)
         configure_gemini_for_request() 
@@ -166,7 +423,7 @@ def generate_explanation_route(current_user_id):
         # 3. Handle different modes ('explain' or 'quiz')
         if mode == 'explain':
             # This function returns a dictionary with explanation, image_urls, AND suggestions.
-            content_data = generate_explanation(word, streak_context, language, time.time())
+            content_data = generate_explanation(word, streak_context, language, time.time(), db=db)
             
             # We return the entire dictionary to the frontend.
             return jsonify(content_data)
@@ -184,12 +441,42 @@ def generate_explanation_route(current_user_id):
         else:
             return jsonify({"error": "Invalid mode specified"}), 400
             
+    except HTTPException:
+        raise  # 413/400/415 from parsing the body keep their status
     except Exception as e:
         app.logger.error(f"Error in /generate_explanation for user {current_user_id or 'Guest'} on word '{word}': {e}")
         return jsonify({"error": f"An internal AI error occurred: {str(e)}"}), 500
 
     
 
+@app.route('/generate_explanation/stream', methods=['POST'])
+@token_optional
+@limiter.limit(generation_limit)
+def generate_explanation_stream_route(current_user_id):
+    """
+    Server-Sent Events variant of /generate_explanation (explain mode only).
+    Emits 'delta' events with explanation text as Gemini produces it, then one
+    'complete' (or 'error') event carrying the same payload the JSON route returns.
+    """
+    try:
+        configure_gemini_for_request()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 500
+
+    data = request.get_json()
+    word = data.get('word', '').strip()
+    language = data.get('language', 'en')
+    streak_context = data.get('streakContext', [])
+    if not word:
+        return jsonify({"error": "Word/concept is required"}), 400
+
+    def generate_events():
+        for event, payload in stream_explanation(word, streak_context, language, time.time(), db=db):
+            yield f"event: {event}\ndata: {orjson.dumps(payload).decode('utf-8')}\n\n"
+
+    return Response(stream_with_context(generate_events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # In app.py, replace the existing /fetch_web_context route with this:
 @app.route('/fetch_web_context', methods=['POST'])
 @token_optional
@@ -198,6 +485,7 @@ def fetch_web_context_route(current_user_id):
     """
     Fetches relevant web links by routing the query to the best data source.
     """
+    query = ''
     try:
         configure_gemini_for_request()
         # The 'topic' from the frontend is now the full query, e.g., "news about adidas"
@@ -205,13 +493,15 @@ def fetch_web_context_route(current_user_id):
         if not query:
             return jsonify({"error": "Query is required"}), 400
 
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        
         # Call the new router function instead of the old one
-        web_context = get_routed_web_context(query, model)
+        # Built per request: a GenerativeModel keeps the API key it first ran with,
+        # and configure_gemini_for_request() may have just switched to the user's key.
+        web_context = get_routed_web_context(query, genai.GenerativeModel('gemini-1.5-flash-latest'))
 
         return jsonify({"topic": query, "web_context": web_context})
 
+    except HTTPException:
+        raise
     except Exception as e:
         app.logger.error(f"Error in /fetch_web_context for query '{query}': {e}")
         return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
@@ -293,6 +583,8 @@ def generate_story_node_route(current_user_id):
             language=language
         )
         return jsonify(parsed_node), 200
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({"error": "An unexpected server error occurred."}), 500
 
@@ -306,15 +598,31 @@ def generate_game_route(current_user_id):
         if not topic: return jsonify({"error": "Topic is required"}), 400
         reasoning, game_html = generate_game_for_topic(topic)
         return jsonify({"topic": topic, "game_html": game_html, "reasoning": reasoning}), 200
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
 
+# Word history is always paged; larger requested pages are clamped to the max
+PROFILE_WORDS_PAGE_SIZE = 50
+MAX_PROFILE_WORDS_PAGE_SIZE = 200
+
 @app.route('/profile', methods=['GET'])
 @token_required
 def get_user_profile(current_user_id):
     try:
-        profile_data = get_user_profile_data(db, current_user_id)
+        words_limit = request.args.get('limit', type=int)
+        if 'limit' in request.args and (words_limit is None or words_limit < 1):
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        words_limit = min(words_limit or PROFILE_WORDS_PAGE_SIZE, MAX_PROFILE_WORDS_PAGE_SIZE)
+        words_after = request.args.get('after')
+        # The cursor is looked up as a word_history doc ID
+        if words_after is not None and not is_valid_doc_id(words_after):
+            return jsonify({"error": "Invalid after cursor"}), 400
+        profile_data = get_user_profile_data(db, current_user_id, words_limit, words_after)
         return jsonify(profile_data), 200
+    except PageCursorNotFoundError:
+        return jsonify({"error": "Unknown after cursor"}), 400
     except Exception as e:
         app.logger.error(f"Failed to fetch profile for user {current_user_id}: {e}")
         return jsonify({"error": f"Failed to fetch profile: {str(e)}"}), 500
@@ -324,9 +632,15 @@ def get_user_profile(current_user_id):
 def toggle_favorite_route(current_user_id):
     word = request.json.get('word', '').strip()
     if not word: return jsonify({"error": "Word is required"}), 400
+    # Optional explicit target state; lets the handler skip reading the current flag
+    is_favorite = request.json.get('is_favorite')
+    if is_favorite is not None and not isinstance(is_favorite, bool):
+        return jsonify({"error": "is_favorite must be a boolean"}), 400
     try:
-        new_status = toggle_favorite_status(db, current_user_id, word)
+        new_status = toggle_favorite_status(db, current_user_id, word, is_favorite)
         return jsonify({"message": "Favorite status updated", "word": word, "is_favorite": new_status}), 200
+    except exceptions.NotFound:
+        return jsonify({"error": "User not found."}), 404
     except Exception as e:
         app.logger.error(f"Failed to toggle favorite for user {current_user_id}: {e}")
         return jsonify({"error": f"Failed to toggle favorite: {str(e)}"}), 500
@@ -357,6 +671,8 @@ def save_quiz_attempt_route(current_user_id):
     try:
         save_quiz_attempt_to_db(db, current_user_id, word, is_correct)
         return jsonify({"message": "Quiz attempt processed and stats updated"}), 200
+    except exceptions.NotFound:
+        return jsonify({"error": "User not found."}), 404
     except Exception as e:
         app.logger.error(f"Failed to save quiz stats for user {current_user_id}: {e}")
         return jsonify({"error": f"Failed to save quiz attempt: {str(e)}"}), 500
@@ -377,7 +693,7 @@ def validate_api_key():
         return jsonify({"valid": False, "message": "No API key was provided."}), 400
 
     # Store the application's default key to restore it later
-    original_key = os.getenv('GEMINI_API_KEY')
+    original_key = GEMINI_API_KEY
     
     try:
         # --- The Validation Step ---
@@ -389,12 +705,12 @@ def validate_api_key():
         
         # 3. Make a very small, cheap, but definitive API call.
         # An invalid key will raise a PermissionDenied error here.
-        model.generate_content("test", generation_config=genai.types.GenerationConfig(max_output_tokens=1))
+        model.generate_content("test", generation_config=KEY_VALIDATION_CONFIG)
         
         # 4. If the call succeeds, the key is valid.
         return jsonify({"valid": True, "message": "API Key is valid!"}), 200
 
-    except google_exceptions.PermissionDenied:
+    except exceptions.PermissionDenied:
         # This is the specific error for an invalid or unauthorized key.
         return jsonify({"valid": False, "message": "API key is invalid or not enabled for the Gemini API."}), 400
     except Exception as e:
@@ -417,14 +733,26 @@ def delete_account_route(current_user_id):
     Handles the permanent deletion of a user's account and all associated data.
     """
     try:
-        user_ref = db.collection('users').document(current_user_id)
+        user_ref = users_collection.document(current_user_id)
+        # Only the keys of the username/email reservations are needed
+        user_doc = user_ref.get(field_paths=['username_lowercase', 'email'])
         
         # 1. Recursively delete subcollections
         for collection_ref in user_ref.collections():
             delete_collection(collection_ref, 50) # Batch size of 50
             
-        # 2. Delete the main user document
-        user_ref.delete()
+        # 2. Release the username/email reservations and delete the main user document together
+        batch = db.batch()
+        user_data = user_doc.to_dict() if user_doc.exists else {}
+        if user_data:
+            delete_user_index_entries(db, user_data, batch)
+        batch.delete(user_ref)
+        batch.commit()
+        with _taken_identifier_cache_lock:
+            _taken_identifier_cache.pop(('username', user_data.get('username_lowercase')), None)
+            _taken_identifier_cache.pop(('email', user_data.get('email')), None)
+        with _user_tier_cache_lock:
+            _user_tier_cache.pop(current_user_id, None)
         
         app.logger.info(f"Successfully deleted account and all data for user_id: {current_user_id}")
         return jsonify({"message": "Account successfully deleted."}), 200
@@ -443,48 +771,78 @@ def index():
 @app.route('/signup', methods=['POST'])
 @limiter.limit("5 per hour")
 def signup_user():
+    if (request.content_length or 0) > MAX_AUTH_BODY_BYTES:
+        return jsonify({"error": "Request body too large"}), 413
     data = request.json
     username = data.get('username', '').strip()
     email = data.get('email', '').strip().lower()
     password = data.get('password')
     if not all([username, email, password]):
         return jsonify({"error": "Username, email, and password are required"}), 400
+    if len(email) > MAX_EMAIL_LENGTH or not _EMAIL_RE.fullmatch(email) or not is_valid_doc_id(email):
+        return jsonify({"error": "Invalid email address"}), 400
+    if len(password) > MAX_PASSWORD_LENGTH:
+        return jsonify({"error": f"Password must be at most {MAX_PASSWORD_LENGTH} characters"}), 400
+    if len(username) > MAX_USERNAME_LENGTH or not is_valid_doc_id(username.lower()):
+        return jsonify({"error": f"Username must be at most {MAX_USERNAME_LENGTH} characters without '/', and can't be '.', '..' or start and end with '__'"}), 400
     
-    users_ref = db.collection('users')
-    if users_ref.where('username_lowercase', '==', username.lower()).limit(1).get():
-        return jsonify({"error": "Username already exists"}), 409
-    if users_ref.where('email', '==', email).limit(1).get():
-        return jsonify({"error": "Email already registered"}), 409
-        
-    users_ref.add({
-        'username': username, 'username_lowercase': username.lower(), 'email': email,
-        'password_hash': generate_password_hash(password), 'tier': 'free',
-        'created_at': firestore.SERVER_TIMESTAMP, 'quiz_points': 0,
-        'total_quiz_questions_answered': 0, 'total_quiz_questions_correct': 0
-    })
+    username_key, email_key = ('username', username.lower()), ('email', email)
+    with _taken_identifier_cache_lock:
+        taken_error = _taken_identifier_cache.get(username_key) or _taken_identifier_cache.get(email_key)
+    if taken_error:
+        return jsonify({"error": taken_error}), 409
+
+    try:
+        create_user_account(db, {
+            'username': username, 'username_lowercase': username.lower(), 'email': email,
+            'password_hash': _hash_password(password), 'tier': 'free',
+            'created_at': firestore.SERVER_TIMESTAMP, 'quiz_points': 0,
+            'total_quiz_questions_answered': 0, 'total_quiz_questions_correct': 0
+        })
+    except IdentifierTakenError as e:
+        with _taken_identifier_cache_lock:
+            _taken_identifier_cache[username_key if e.field == 'username' else email_key] = str(e)
+        return jsonify({"error": str(e)}), 409
+    with _taken_identifier_cache_lock:
+        _taken_identifier_cache[username_key] = "Username already exists"
+        _taken_identifier_cache[email_key] = "Email already registered"
     return jsonify({"message": "User created successfully"}), 201
 
 @app.route('/login', methods=['POST'])
 @limiter.limit("30 per minute")
 def login_user():
+    if (request.content_length or 0) > MAX_AUTH_BODY_BYTES:
+        return jsonify({"error": "Request body too large"}), 413
     data = request.json
     identifier = data.get('email_or_username', '').strip()
     password = data.get('password', '')
     if not identifier or not password:
         return jsonify({"error": "Missing username/email or password"}), 400
+    if len(password) > MAX_PASSWORD_LENGTH:
+        return jsonify({"error": "Invalid credentials"}), 401
 
-    is_email = '@' in identifier
-    query_field = 'email' if is_email else 'username_lowercase'
-    docs = db.collection('users').where(query_field, '==', identifier.lower()).limit(1).stream()
-    
-    user_doc = next(docs, None)
-    if not user_doc:
+    # Resolve the uid through the uniqueness index with a point read instead of a query
+    user_id = find_user_id_by_identifier(db, identifier)
+    if user_id is None:
+        _burn_password_check(password)
+        return jsonify({"error": "Invalid credentials"}), 401
+
+    # Only what authentication and the response need; the rest of the user doc stays server-side
+    user_doc = users_collection.document(user_id).get(field_paths=_LOGIN_FIELDS)
+    if not user_doc.exists:
+        _burn_password_check(password)
         return jsonify({"error": "Invalid credentials"}), 401
     
     user_data = user_doc.to_dict()
-    if not check_password_hash(user_data.get('password_hash', ''), password):
+    stored_hash = user_data.get('password_hash', '')
+    if not _verify_password(stored_hash, password):
         return jsonify({"error": "Invalid credentials"}), 401
 
+    # Lazily migrate legacy pbkdf2 hashes (or outdated argon2 parameters). The
+    # response doesn't depend on it, so the hash + write run after we return.
+    if _password_needs_rehash(stored_hash):
+        _rehash_pool.submit(_upgrade_password_hash, user_doc.reference, password)
+
     token_payload = {
         'user_id': user_doc.id,
         'exp': datetime.now(timezone.utc) + app.config['JWT_ACCESS_TOKEN_EXPIRES']
@@ -496,6 +854,12 @@ def login_user():
         "user": {"id": user_doc.id, "username": user_data.get('username'), "email": user_data.get('email')}
     }), 200
 
+@app.cli.command('backfill-user-indexes')
+def backfill_user_indexes_command():
+    """Creates username/email index docs for accounts that predate them."""
+    written = backfill_user_indexes(db)
+    click.echo(f"Wrote {written} index docs.")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     app.run(host='0.0.0.0', port=port)
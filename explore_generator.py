@@ -1,25 +1,104 @@
 import google.generativeai as genai
 import logging
+import redis
 import requests
-import json
+import orjson
 import os
+import threading
 import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote_plus
+from cachetools import TTLCache
+from firestore_handler import get_shared_word_content, save_shared_word_content
+
+# Models are built per call rather than at import: a GenerativeModel keeps the
+# client (and so the API key) it first ran with, while the key is configured per
+# request and may be the user's own.
+GEMINI_MODEL_NAME = 'gemini-1.5-flash-latest'
+# Stored with shared 'word_content' entries and part of every Redis key, so
+# content from another version is regenerated. Bump the suffix when a prompt changes.
+SHARED_CONTENT_VERSION = f"{GEMINI_MODEL_NAME}:1"
+
+SUGGESTIONS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "suggestions": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["suggestions"],
+}
+
+# Constrains suggestion replies to SUGGESTIONS_SCHEMA so they are always bare, parseable JSON.
+SUGGESTIONS_GENERATION_CONFIG = genai.types.GenerationConfig(response_mime_type="application/json", response_schema=SUGGESTIONS_SCHEMA)
+
+# Process-local cache of generated content, keyed by (mode, word, language, context).
+# Popular words are requested by many users; a hit skips the Gemini round-trip entirely.
+# Only successful generations are stored.
+_content_cache = TTLCache(maxsize=5000, ttl=3600)
+_content_cache_lock = threading.Lock()
+# Explanations missing their images or suggestions (a Pexels or Gemini hiccup)
+# are only kept here, briefly, so a later request regenerates the missing parts
+# instead of the gap being persisted to Redis and Firestore.
+_partial_content_cache = TTLCache(maxsize=1000, ttl=300)
+
+# When REDIS_URL is set, the same entries are shared across workers and instances
+# through Redis, checked after the process-local cache misses.
+REDIS_CONTENT_TTL_SECONDS = 7 * 24 * 3600
+_redis_url = os.getenv('REDIS_URL')
+_redis = redis.Redis.from_url(_redis_url, socket_connect_timeout=1, socket_timeout=1) if _redis_url else None
+
+# Runs network calls that don't depend on the Gemini output alongside it.
+_io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='explore-io')
+
+def _redis_key(key):
+    return "genai:" + key[0] + ":" + hashlib.sha256(orjson.dumps((SHARED_CONTENT_VERSION,) + key)).hexdigest()
+
+def _get_cached_content(key):
+    with _content_cache_lock:
+        value = _content_cache.get(key)
+        if value is None:
+            value = _partial_content_cache.get(key)
+    if value is not None or _redis is None:
+        return value
 
-gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest')
+    try:
+        raw = _redis.get(_redis_key(key))
+    except redis.RedisError as e:
+        logging.error(f"Redis content cache read failed: {e}")
+        return None
+    if raw is None:
+        return None
+    value = orjson.loads(raw)
+    with _content_cache_lock:
+        _content_cache[key] = value
+    return value
+
+def _set_cached_content(key, value):
+    with _content_cache_lock:
+        _content_cache[key] = value
+    if _redis is not None:
+        try:
+            _redis.setex(_redis_key(key), REDIS_CONTENT_TTL_SECONDS, orjson.dumps(value))
+        except redis.RedisError as e:
+            logging.error(f"Redis content cache write failed: {e}")
+
+def _set_partial_cached_content(key, value):
+    with _content_cache_lock:
+        _partial_content_cache[key] = value
 
 
 def get_image_urls_for_topic(topic: str, num_images: int = 2):
     """
     Performs a reliable image search using the official Pexels API.
     This is the definitive, stable method for getting images.
+    Returns None if the search couldn't be made, as opposed to [] for no results.
     """
-    logging.warning(f"--- Starting Pexels API image search for topic: '{topic}' ---")
+    logging.debug("--- Starting Pexels API image search for topic: '%s' ---", topic)
     
     api_key = os.getenv("PEXELS_API_KEY")
     if not api_key:
         logging.error("PEXELS_API_KEY is not set. Cannot search for images.")
-        return []
+        return None
 
     try:
         headers = {"Authorization": api_key}
@@ -34,22 +113,23 @@ def get_image_urls_for_topic(topic: str, num_images: int = 2):
         # Extract the 'large' image URL from each photo result
         image_urls = [photo['src']['large'] for photo in data.get('photos', [])]
         
-        logging.warning(f"--- Found {len(image_urls)} images from Pexels for '{topic}': {image_urls} ---")
+        logging.debug("--- Found %d images from Pexels for '%s': %s ---", len(image_urls), topic, image_urls)
         return image_urls
 
     except requests.exceptions.RequestException as e:
         logging.error(f"Pexels API request FAILED for topic '{topic}': {e}")
-        return []
+        return None
     except Exception as e:
         logging.error(f"An UNEXPECTED error occurred during Pexels search for topic '{topic}': {e}")
-        return []
+        return None
     
 def generate_agentic_suggestions(topic: str, language: str = 'en', explanation_text: str = ''):
     """
     Analyzes a topic's type and generates a list of clear, actionable search intents
     that map closely to available tools. [IMPROVED VERSION]
+    Returns None if generation failed.
     """
-    logging.warning(f"--- Generating clear, actionable search intents for topic: '{topic}' ---")
+    logging.debug("--- Generating clear, actionable search intents for topic: '%s' ---", topic)
     
     prompt = f"""
     You are a creative and practical guide. Your goal is to give a user real-world, actionable things to do related to a topic they are learning about.
@@ -74,29 +154,18 @@ def generate_agentic_suggestions(topic: str, language: str = 'en', explanation_t
     """
     
     try:
-        response = gemini_model.generate_content(prompt)
-        
-        clean_response = response.text.strip()
-        if clean_response.startswith("```json"):
-            clean_response = clean_response[7:-3].strip()
-        elif clean_response.startswith("```"):
-             clean_response = clean_response[3:-3].strip()
-
-        suggestions_dict = json.loads(clean_response)
-        suggestions = suggestions_dict.get("suggestions", [])
+        suggestions_model = genai.GenerativeModel(GEMINI_MODEL_NAME, generation_config=SUGGESTIONS_GENERATION_CONFIG)
+        response = suggestions_model.generate_content(prompt)
+        suggestions = orjson.loads(response.text)["suggestions"]
 
-        logging.warning(f"--- Found clear suggestions for '{topic}': {suggestions} ---")
+        logging.debug("--- Found clear suggestions for '%s': %s ---", topic, suggestions)
         return suggestions
 
     except Exception as e:
         logging.error(f"Could not generate or parse clear agentic suggestions for '{topic}': {e}")
-        return []
+        return None
     
-def generate_explanation(word: str, streak_context: list = None, language: str = 'en', nonce: float = 0.0):
-    """
-    Generates a meaningful, concise explanation designed for learning and action, 
-    and finds related images and agentic suggestions.
-    """
+def _build_explanation_prompt(word: str, streak_context: list, language: str, nonce: float) -> str:
     prompt = ""
     # This is the prompt for a new topic or the first in a streak.
     if not streak_context:
@@ -151,40 +220,108 @@ In the context of an API, a <click>data request</click> is a structured message
 
 Nonce: {nonce}
 """
+    return prompt
+
 
+def _save_shared_explanation(db, word: str, language: str, content_data: dict):
     try:
-        # Step 1: Generate the text explanation
-        # Assuming gemini_model is your generative model client
-        response = gemini_model.generate_content(prompt)
-        explanation_text = response.text.strip()
+        save_shared_word_content(db, word, 'explain', language, content_data, SHARED_CONTENT_VERSION)
+    except Exception as e:
+        logging.error(f"Could not store shared content for word '{word}': {e}")
+
+def stream_explanation(word: str, streak_context: list = None, language: str = 'en', nonce: float = 0.0, db=None):
+    """
+    Generator form of generate_explanation. Yields ('delta', text) as Gemini
+    produces the explanation, then a final ('complete', content_data), or
+    ('error', content_data) carrying the fallback structure if generation failed.
+    When a Firestore client is passed, context-free explanations are shared
+    across users through the 'word_content' collection.
+    """
+    cache_key = ('explain', word.strip().lower(), language, tuple(streak_context or ()))
+    cached = _get_cached_content(cache_key)
+    if cached is not None:
+        yield 'complete', cached
+        return
+
+    # Only explanations without a learning path are user-independent
+    use_shared_cache = db is not None and not streak_context
+    if use_shared_cache:
+        try:
+            shared = get_shared_word_content(db, word, 'explain', language, SHARED_CONTENT_VERSION)
+            if shared is not None:
+                _set_cached_content(cache_key, shared)
+                yield 'complete', shared
+                return
+        except Exception as e:
+            logging.error(f"Shared content lookup failed for word '{word}': {e}")
+
+    prompt = _build_explanation_prompt(word, streak_context, language, nonce)
+
+    try:
+        # The image search only needs the word, so start it before the Gemini call
+        image_urls_future = _io_pool.submit(get_image_urls_for_topic, word)
+
+        # Step 1: Generate the text explanation, passing chunks on as they arrive
+        text_chunks = []
+        for chunk in genai.GenerativeModel(GEMINI_MODEL_NAME).generate_content(prompt, stream=True):
+            if chunk.text:
+                text_chunks.append(chunk.text)
+                yield 'delta', chunk.text
+        explanation_text = "".join(text_chunks).strip()
         
-        # Step 2: Get image URLs for the topic
-        image_urls = get_image_urls_for_topic(word)
+        # Step 2: Collect the image URLs fetched in the background
+        image_urls = image_urls_future.result()
 
         # --- Step 3: Get the new Agentic Suggestions ---
         # This function can now be more effective because the explanation is more practical
         suggestions = generate_agentic_suggestions(word, language, explanation_text)
 
         # Step 4: Return a dictionary containing all parts
-        return {
+        content_data = {
             "explanation": explanation_text,
-            "image_urls": image_urls,
-            "suggestions": suggestions
+            "image_urls": image_urls if image_urls is not None else [],
+            "suggestions": suggestions if suggestions is not None else []
         }
+        is_complete = bool(explanation_text) and image_urls is not None and suggestions is not None
+        if is_complete:
+            _set_cached_content(cache_key, content_data)
+        else:
+            # Serve what we have, but don't let a transient failure stick to the word
+            _set_partial_cached_content(cache_key, content_data)
+        if use_shared_cache and is_complete:
+            # The shared-cache write is off the response's critical path
+            _io_pool.submit(_save_shared_explanation, db, word, language, content_data)
+        yield 'complete', content_data
         
     except Exception as e:
         logging.error(f"Error in generate_explanation for word '{word}': {e}")
         # Return a valid structure even on error
-        return {
+        yield 'error', {
             "explanation": f"Sorry, an error occurred while explaining '{word}'.",
             "image_urls": [],
             "suggestions": []
         }
 
+def generate_explanation(word: str, streak_context: list = None, language: str = 'en', nonce: float = 0.0, db=None):
+    """
+    Generates a meaningful, concise explanation designed for learning and action, 
+    and finds related images and agentic suggestions.
+    """
+    content_data = None
+    for _, content_data in stream_explanation(word, streak_context, language, nonce, db):
+        pass
+    return content_data
+
 def generate_quiz_from_text(word: str, explanation_text: str, streak_context: list = None, language: str = 'en', nonce: float = 0.0):
     """
     Generates a multiple-choice quiz question based on provided text.
     """
+    explanation_digest = hashlib.sha256(explanation_text.encode('utf-8')).hexdigest()
+    cache_key = ('quiz', word.strip().lower(), language, explanation_digest, tuple(streak_context or ()))
+    cached = _get_cached_content(cache_key)
+    if cached is not None:
+        return cached
+
     context_hint_for_quiz = ""
     if streak_context:
         context_hint_for_quiz = f" The learning path so far included: {', '.join(streak_context)}."
@@ -214,20 +351,22 @@ Nonce: {nonce}
 """
     
     try:
-        logging.warning(f"QUIZ PROMPT SENT TO AI: {prompt}")
+        logging.debug("QUIZ PROMPT SENT TO AI: %s", prompt)
         
-        response = gemini_model.generate_content(prompt)
+        response = genai.GenerativeModel(GEMINI_MODEL_NAME).generate_content(prompt)
         llm_output_text = response.text.strip()
         
         # NEW: Check for the fallback response from the AI
         if "---NO_QUIZ_POSSIBLE---" in llm_output_text:
-            logging.warning(f"AI determined no quiz was possible for word '{word}'.")
+            logging.info("AI determined no quiz was possible for word '%s'.", word)
+            _set_cached_content(cache_key, [])
             return [] # Return an empty list, which is a stable response
 
         quiz_questions_array = [q.strip() for q in llm_output_text.split('---QUIZ_SEPARATOR---') if q.strip()]
         if not quiz_questions_array and llm_output_text:
             quiz_questions_array = [llm_output_text]
-            
+
+        _set_cached_content(cache_key, quiz_questions_array)
         return quiz_questions_array
     except Exception as e:
         logging.error(f"Error in generate_quiz_from_text for word '{word}': {e}")
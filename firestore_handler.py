@@ -3,23 +3,269 @@
 from firebase_admin import firestore
 from datetime import datetime, timezone, timedelta
 from google.cloud.firestore_v1.base_query import FieldFilter
+from google.api_core.exceptions import Conflict, NotFound
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import logging
+import re
+
+# Compiled once at import; sanitize_word_for_id runs on every word-history write.
+_WHITESPACE_RE = re.compile(r'\s+')
+_NON_ID_CHARS_RE = re.compile(r'[^a-z0-9_]')
+# str.translate table deleting every ASCII character outside [a-z0-9_]
+_ID_DELETE_TABLE = {c: None for c in range(128) if not (chr(c).isdigit() or 'a' <= chr(c) <= 'z' or chr(c) == '_')}
+
+# Only the fields the streak history list renders are transferred.
+_STREAK_HISTORY_FIELDS = ['words', 'score', 'completed_at']
+
+# User-doc fields rendered on the profile; skips password_hash and anything else stored there.
+_PROFILE_FIELDS = [
+    'username', 'email', 'tier', 'created_at', 'quiz_points',
+    'total_quiz_questions_answered', 'total_quiz_questions_correct'
+]
+
+# List-view fields of a word_history doc; skips the generated content cache.
+_WORD_HISTORY_FIELDS = ['word', 'is_favorite', 'last_explored_at', 'first_explored_at']
+
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+
+# Shared 'word_content' entries are regenerated after this long even if the
+# prompt/model version hasn't changed.
+SHARED_CONTENT_MAX_AGE = timedelta(days=30)
+
+# Shared pool for overlapping independent Firestore round-trips within one request.
+_io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='firestore-io')
 
 def sanitize_word_for_id(word: str) -> str:
     """A helper function to ensure consistent document IDs."""
     if not isinstance(word, str): return "invalid_input"
-    import re
     sanitized = word.lower()
-    sanitized = re.sub(r'\s+', '_', sanitized)
-    sanitized = re.sub(r'[^a-z0-9_]', '', sanitized)
+    if sanitized.isascii():
+        # Fast path without the regex engine; produces exactly what the patterns below would
+        parts = sanitized.split()
+        joined = '_'.join(parts)
+        if sanitized[:1].isspace():
+            joined = '_' + joined
+        if parts and sanitized[-1].isspace():
+            joined += '_'
+        sanitized = joined.translate(_ID_DELETE_TABLE)
+    else:
+        sanitized = _WHITESPACE_RE.sub('_', sanitized)
+        sanitized = _NON_ID_CHARS_RE.sub('', sanitized)
     return sanitized if sanitized else "empty_word"
 
-def get_user_profile_data(db, user_id: str):
+def is_valid_doc_id(doc_id: str) -> bool:
+    """True if Firestore accepts doc_id as a document ID (document() raises otherwise)."""
+    return (
+        bool(doc_id) and '/' not in doc_id and doc_id not in ('.', '..')
+        and not (len(doc_id) >= 4 and doc_id.startswith('__') and doc_id.endswith('__'))
+        and len(doc_id.encode('utf-8')) <= 1500
+    )
+
+class IdentifierTakenError(Exception):
+    """Raised by create_user_account when the username or email is already registered."""
+    def __init__(self, field: str, message: str):
+        super().__init__(message)
+        self.field = field  # 'username' or 'email'
+
+def _find_legacy_user(db, field: str, value: str, transaction=None):
+    """
+    Returns the user doc holding value in field through a field query, or None.
+    Covers accounts created before the index collections, which have no
+    sentinel until backfill_user_indexes runs or the user next logs in.
+    """
+    query = db.collection('users').where(filter=FieldFilter(field, '==', value)).select([]).limit(1)
+    return next(iter(query.stream(transaction=transaction)), None)
+
+@firestore.transactional
+def _create_user_in_transaction(transaction, db, user_data: dict):
+    """Reads both uniqueness sentinels and writes the user + sentinels atomically."""
+    username_index_ref = db.collection('username_index').document(user_data['username_lowercase'])
+    email_index_ref = db.collection('email_index').document(user_data['email'])
+
+    # Both sentinels come back from a single BatchGetDocuments round-trip
+    taken = {snapshot.reference.path for snapshot in db.get_all([username_index_ref, email_index_ref], transaction=transaction) if snapshot.exists}
+    # A missing sentinel may still belong to a legacy account, so check the field too
+    if (username_index_ref.path in taken
+            or _find_legacy_user(db, 'username_lowercase', user_data['username_lowercase'], transaction)):
+        raise IdentifierTakenError('username', "Username already exists")
+    if (email_index_ref.path in taken
+            or _find_legacy_user(db, 'email', user_data['email'], transaction)):
+        raise IdentifierTakenError('email', "Email already registered")
+
+    user_ref = db.collection('users').document()
+    transaction.set(user_ref, user_data)
+    transaction.set(username_index_ref, {'uid': user_ref.id})
+    transaction.set(email_index_ref, {'uid': user_ref.id})
+    return user_ref.id
+
+def create_user_account(db, user_data: dict) -> str:
+    """
+    Creates a user document, enforcing username/email uniqueness through the
+    'username_index' and 'email_index' collections (doc ID = lowercased key).
+    A key without a sentinel is also checked against the users collection,
+    since accounts from before the indexes may not have one yet. Raises
+    IdentifierTakenError if either is already taken.
+    """
+    return _create_user_in_transaction(db.transaction(), db, user_data)
+
+def find_user_id_by_identifier(db, identifier: str):
     """
-    Fetches and formats all profile data for a given user, respecting their tier.
+    Resolves a login email/username to a uid through its index doc. Accounts
+    created before the indexes existed are found with the old field query once,
+    and their index doc is written so later logins take the point read.
+    Returns None if no account matches.
+    """
+    is_email = '@' in identifier
+    key = identifier.lower()
+    if not is_valid_doc_id(key):
+        return None
+    index_ref = db.collection('email_index' if is_email else 'username_index').document(key)
+    index_doc = index_ref.get()
+    if index_doc.exists:
+        return index_doc.get('uid')
+
+    legacy_doc = _find_legacy_user(db, 'email' if is_email else 'username_lowercase', key)
+    if legacy_doc is None:
+        return None
+    try:
+        index_ref.create({'uid': legacy_doc.id})
+    except Conflict:
+        pass  # Claimed concurrently; the account itself is still the one we found
+    return legacy_doc.id
+
+def delete_user_index_entries(db, user_data: dict, batch=None):
+    """
+    Releases the username/email sentinels held by a user being deleted.
+    If a batch is passed the deletes are added to it for the caller to commit.
+    """
+    own_batch = batch is None
+    if own_batch:
+        batch = db.batch()
+    if user_data.get('username_lowercase'):
+        batch.delete(db.collection('username_index').document(user_data['username_lowercase']))
+    if user_data.get('email'):
+        batch.delete(db.collection('email_index').document(user_data['email']))
+    if own_batch:
+        batch.commit()
+
+def backfill_user_indexes(db):
+    """
+    One-off migration: creates index sentinels for users created before they
+    existed. Run with `flask --app app backfill-user-indexes`. Returns the
+    number of index docs written.
+    """
+    batch = db.batch()
+    pending = written = 0
+    # Only the two indexed fields are needed from each user doc
+    for doc in db.collection('users').select(['username_lowercase', 'email']).stream():
+        user = doc.to_dict()
+        # Legacy values Firestore can't use as a document ID get no index entry
+        if is_valid_doc_id(user.get('username_lowercase')):
+            batch.set(db.collection('username_index').document(user['username_lowercase']), {'uid': doc.id})
+            pending += 1
+        if is_valid_doc_id(user.get('email')):
+            batch.set(db.collection('email_index').document(user['email']), {'uid': doc.id})
+            pending += 1
+        if pending >= 400:
+            batch.commit()
+            written += pending
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+        written += pending
+    return written
+
+def _shared_word_content_ref(db, word: str):
+    """
+    Doc for a word in 'word_content'. sanitize_word_for_id is lossy (every
+    non-ASCII word becomes 'empty_word', 'C++' and 'C' both become 'c'), so
+    the doc ID is a digest of the normalized word instead.
+    """
+    normalized_word = word.strip().lower()
+    doc_id = hashlib.sha256(normalized_word.encode('utf-8')).hexdigest()
+    return db.collection('word_content').document(doc_id), normalized_word
+
+def get_shared_word_content(db, word: str, mode: str, language: str, version: str):
+    """
+    Returns user-independent generated content for a word from the shared
+    'word_content' collection, or None if it hasn't been generated yet.
+    Entries written by another prompt/model version, or older than
+    SHARED_CONTENT_MAX_AGE, count as missing so they get regenerated.
+    """
+    doc_ref, normalized_word = _shared_word_content_ref(db, word)
+    doc = doc_ref.get()
+    if not doc.exists:
+        return None
+    data = doc.to_dict()
+    # Never serve content stored for a different word
+    if data.get('word') != normalized_word:
+        return None
+    entry = (data.get('modes') or {}).get(f"{mode}_{language}")
+    # Entries from before versioning were the bare content, without these fields
+    if not isinstance(entry, dict) or entry.get('version') != version:
+        return None
+    generated_at = entry.get('generated_at')
+    if not isinstance(generated_at, datetime) or datetime.now(timezone.utc) - generated_at > SHARED_CONTENT_MAX_AGE:
+        return None
+    return entry.get('content')
+
+def save_shared_word_content(db, word: str, mode: str, language: str, content, version: str):
+    """Stores generated content in 'word_content' so any user's next request can reuse it."""
+    doc_ref, normalized_word = _shared_word_content_ref(db, word)
+    doc_ref.set({
+        'word': normalized_word,
+        'modes': {f"{mode}_{language}": {
+            'content': content, 'version': version, 'generated_at': firestore.SERVER_TIMESTAMP
+        }}
+    }, merge=True)
+
+def _format_word_history_entry(doc):
+    """Shapes a word_history doc into the list-view entry returned on the profile."""
+    entry = doc.to_dict()
+    last_explored_at_val = entry.get("last_explored_at")
+    first_explored_at_val = entry.get("first_explored_at")
+    return {
+        "id": doc.id,
+        "word": entry.get("word"),
+        "is_favorite": entry.get("is_favorite", False),
+        "last_explored_at": last_explored_at_val.isoformat() if isinstance(last_explored_at_val, datetime) else str(last_explored_at_val),
+        "first_explored_at": first_explored_at_val.isoformat() if isinstance(first_explored_at_val, datetime) else str(first_explored_at_val),
+    }
+
+def _format_streak_entry(doc):
+    """Shapes a streaks doc into the entry returned in streak history lists."""
+    streak = doc.to_dict()
+    completed_at_val = streak.get("completed_at")
+    return {
+        "id": doc.id, "words": streak.get("words", []), "score": streak.get("score", 0),
+        "completed_at": completed_at_val.isoformat() if isinstance(completed_at_val, datetime) else str(completed_at_val),
+    }
+
+class PageCursorNotFoundError(Exception):
+    """Raised by get_user_profile_data when words_after names no word_history entry."""
+
+def get_user_profile_data(db, user_id: str, words_limit: int, words_after: str = None):
+    """
+    Fetches and formats profile data for a given user, respecting their tier.
+    The word history is paged: words_limit entries per call, starting after
+    words_after (the exploredWordsNextCursor of the previous page). Totals,
+    favorites and streak history only come with the first page; later pages
+    carry just the next slice of exploredWords and its cursor.
     """
     user_doc_ref = db.collection('users').document(user_id)
-    user_doc = user_doc_ref.get()
+    word_history_ref = user_doc_ref.collection('word_history')
+    if words_after:
+        # Fetch the page cursor alongside the user doc in one batched read; the
+        # mask keeps the cursor's ordering field, which start_after needs.
+        cursor_ref = word_history_ref.document(words_after)
+        snapshots = {snap.reference.path: snap for snap in db.get_all(
+            [user_doc_ref, cursor_ref], field_paths=_PROFILE_FIELDS + ['last_explored_at']
+        )}
+        user_doc, cursor_doc = snapshots[user_doc_ref.path], snapshots[cursor_ref.path]
+    else:
+        user_doc, cursor_doc = user_doc_ref.get(field_paths=_PROFILE_FIELDS), None
     if not user_doc.exists:
         raise ValueError("User not found")
 
@@ -46,69 +292,108 @@ def get_user_profile_data(db, user_id: str):
 
     # NEW: Only fetch and add the detailed lists if the user is a 'pro' member
     if user_tier == 'pro':
-        word_history_list = []
-        favorite_words_list = []
-
-        word_history_query = user_doc_ref.collection('word_history').order_by('last_explored_at', direction=firestore.Query.DESCENDING).stream()
-        for doc in word_history_query:
-            entry = doc.to_dict()
-            if not entry.get("word"):
-                continue
-
-            last_explored_at_val = entry.get("last_explored_at")
-            first_explored_at_val = entry.get("first_explored_at")
-
-            entry_data = {
-                "word": entry.get("word"),
-                "is_favorite": entry.get("is_favorite", False),
-                "last_explored_at": last_explored_at_val.isoformat() if isinstance(last_explored_at_val, datetime) else str(last_explored_at_val),
-                "first_explored_at": first_explored_at_val.isoformat() if isinstance(first_explored_at_val, datetime) else str(first_explored_at_val),
-            }
-            word_history_list.append(entry_data)
-            if entry_data["is_favorite"]:
-                favorite_words_list.append(entry_data)
-
-        streak_history_list = []
-        streak_history_query = user_doc_ref.collection('streaks').order_by('completed_at', direction=firestore.Query.DESCENDING).limit(50).stream()
-        for doc in streak_history_query:
-            streak = doc.to_dict()
-            completed_at_val = streak.get("completed_at")
-            streak_history_list.append({
-                "id": doc.id, "words": streak.get("words", []), "score": streak.get("score", 0),
-                "completed_at": completed_at_val.isoformat() if isinstance(completed_at_val, datetime) else str(completed_at_val),
-            })
+        # Restarting from the top would make a paging client loop forever
+        if cursor_doc is not None and not cursor_doc.exists:
+            raise PageCursorNotFoundError(f"No word history entry '{words_after}'")
+        is_first_page = cursor_doc is None
+
+        word_history_query = word_history_ref.select(_WORD_HISTORY_FIELDS).order_by('last_explored_at', direction=firestore.Query.DESCENDING)
+        if not is_first_page:
+            word_history_query = word_history_query.start_after(cursor_doc)
+        word_history_query = word_history_query.limit(words_limit)
 
-        # Update profile_data with the detailed lists for the 'pro' user
+        # The subcollection reads are independent, so run them concurrently
+        word_history_future = _io_pool.submit(lambda: list(word_history_query.stream()))
+        if is_first_page:
+            streak_history_future = _io_pool.submit(lambda: list(
+                user_doc_ref.collection('streaks').select(_STREAK_HISTORY_FIELDS).order_by('completed_at', direction=firestore.Query.DESCENDING).limit(50).stream()
+            ))
+            # A page doesn't hold every word, so totals and favorites come from their own queries.
+            # The filter skips entries without a word, as the page lists do.
+            total_words_future = _io_pool.submit(
+                lambda: word_history_ref.where(filter=FieldFilter('word', '>', '')).count().get()[0][0].value
+            )
+            favorites_future = _io_pool.submit(lambda: list(
+                word_history_ref.select(_WORD_HISTORY_FIELDS).where(filter=FieldFilter('is_favorite', '==', True)).stream()
+            ))
+
+        word_history_docs = word_history_future.result()
         profile_data.update({
-            "totalWordsExplored": len(word_history_list),
-            "exploredWords": word_history_list,
-            "favoriteWords": favorite_words_list,
-            "streakHistory": streak_history_list,
+            "exploredWords": [entry for entry in map(_format_word_history_entry, word_history_docs) if entry["word"]],
+            "exploredWordsNextCursor": word_history_docs[-1].id if len(word_history_docs) == words_limit else None,
         })
 
+        if is_first_page:
+            favorite_docs = sorted(
+                favorites_future.result(),
+                key=lambda doc: (doc.to_dict() or {}).get('last_explored_at') or _EPOCH, reverse=True
+            )
+            profile_data.update({
+                "totalWordsExplored": total_words_future.result(),
+                "favoriteWords": [entry for entry in map(_format_word_history_entry, favorite_docs) if entry["word"]],
+                "streakHistory": list(map(_format_streak_entry, streak_history_future.result())),
+            })
+        else:
+            # The client keeps these from the first page
+            for key in ("totalWordsExplored", "favoriteWords", "streakHistory"):
+                del profile_data[key]
+
     return profile_data
 
-def toggle_favorite_status(db, user_id: str, word: str):
+def _require_user(transaction, user_ref):
     """
-    Toggles the 'is_favorite' status of a word for a user.
+    Raises NotFound unless the user doc exists. Called before creating a
+    word_history entry: a token can outlive its account by the tier-cache TTL,
+    and the transactional read keeps a concurrent deletion from slipping in.
     """
-    sanitized_word_id = sanitize_word_for_id(word)
-    word_ref = db.collection('users').document(user_id).collection('word_history').document(sanitized_word_id)
-    word_doc = word_ref.get()
+    if not user_ref.get(field_paths=['tier'], transaction=transaction).exists:
+        raise NotFound("User not found")
+
+@firestore.transactional
+def _create_word_entry_in_transaction(transaction, word_ref, entry: dict):
+    """Writes a new word_history entry only if its user still exists."""
+    _require_user(transaction, word_ref.parent.parent)
+    transaction.set(word_ref, entry)
 
+@firestore.transactional
+def _toggle_favorite_in_transaction(transaction, word_ref, word: str):
+    """Flips the flag against a transactional read, so concurrent toggles can't both see the same state."""
+    # Only the flag is needed; skip any generated content stored on the entry
+    word_doc = word_ref.get(field_paths=['is_favorite'], transaction=transaction)
     if not word_doc.exists:
-        word_ref.set({
+        _require_user(transaction, word_ref.parent.parent)
+        transaction.set(word_ref, {
             'word': word, 'first_explored_at': firestore.SERVER_TIMESTAMP,
             'last_explored_at': firestore.SERVER_TIMESTAMP, 'is_favorite': True,
             'generated_content_cache': {}, 'modes_generated': []
         })
-        return True # Returns the new 'is_favorite' status
-
-    current_status = word_doc.to_dict().get('is_favorite', False)
-    new_status = not current_status
-    word_ref.update({'is_favorite': new_status, 'last_explored_at': firestore.SERVER_TIMESTAMP})
+        return True
+    new_status = not word_doc.to_dict().get('is_favorite', False)
+    transaction.update(word_ref, {'is_favorite': new_status, 'last_explored_at': firestore.SERVER_TIMESTAMP})
     return new_status
 
+def toggle_favorite_status(db, user_id: str, word: str, is_favorite: bool = None):
+    """
+    Toggles the 'is_favorite' status of a word for a user.
+    When the caller already knows the desired state (is_favorite), it is written
+    blind, without reading the current flag first.
+    """
+    sanitized_word_id = sanitize_word_for_id(word)
+    word_ref = db.collection('users').document(user_id).collection('word_history').document(sanitized_word_id)
+
+    if is_favorite is None:
+        return _toggle_favorite_in_transaction(db.transaction(), word_ref, word)
+
+    try:
+        word_ref.update({'is_favorite': is_favorite, 'last_explored_at': firestore.SERVER_TIMESTAMP})
+    except NotFound:
+        _create_word_entry_in_transaction(db.transaction(), word_ref, {
+            'word': word, 'first_explored_at': firestore.SERVER_TIMESTAMP,
+            'last_explored_at': firestore.SERVER_TIMESTAMP, 'is_favorite': is_favorite,
+            'generated_content_cache': {}, 'modes_generated': []
+        })
+    return is_favorite # Returns the new 'is_favorite' status
+
 def save_streak_to_db(db, user_id: str, words: list, score: int):
     """
     Saves a completed streak to the database, avoiding recent duplicates.
@@ -117,52 +402,60 @@ def save_streak_to_db(db, user_id: str, words: list, score: int):
     two_minutes_ago = datetime.now(timezone.utc) - timedelta(minutes=2)
 
     # Query for identical streaks in the last 2 minutes to prevent duplicates
-    query = streaks_ref.where(filter=FieldFilter('words', '==', words)).where(filter=FieldFilter('completed_at', '>', two_minutes_ago)).limit(1)
+    # Only existence matters here, so an empty projection returns the doc reference alone
+    query = streaks_ref.where(filter=FieldFilter('words', '==', words)).where(filter=FieldFilter('completed_at', '>', two_minutes_ago)).select([]).limit(1)
     
-    if not list(query.stream()):
+    if next(iter(query.stream()), None) is None:
         streaks_ref.add({'words': words, 'score': score, 'completed_at': firestore.SERVER_TIMESTAMP})
         logging.info(f"Streak saved for user {user_id}")
     else:
         logging.info(f"Duplicate streak detected for user {user_id}. Ignoring.")
     
     # Return the updated streak history
-    streak_history_list = []
-    history_query = streaks_ref.order_by('completed_at', direction=firestore.Query.DESCENDING).limit(50).stream()
-    for doc in history_query:
-        streak = doc.to_dict()
-        completed_at = streak.get("completed_at")
-        streak_history_list.append({
-            "id": doc.id, "words": streak.get("words", []), "score": streak.get("score", 0),
-            "completed_at": completed_at.isoformat() if isinstance(completed_at, datetime) else str(completed_at)
-        })
+    history_query = streaks_ref.select(_STREAK_HISTORY_FIELDS).order_by('completed_at', direction=firestore.Query.DESCENDING).limit(50).stream()
+    streak_history_list = list(map(_format_streak_entry, history_query))
     return streak_history_list
 
 
+# --- Quiz Attempts ---
+# The word entry update and the stat Increments go in one atomic batch. The write
+# is synchronous, so a 200 means it is committed.
+
 def save_quiz_attempt_to_db(db, user_id: str, word: str, is_correct: bool):
     """
     Logs a quiz attempt and updates user stats.
+    The existing-word update is tried first without a read; only if the word has
+    no history doc yet is the batch retried as a create.
     """
     user_ref = db.collection('users').document(user_id)
     word_ref = user_ref.collection('word_history').document(sanitize_word_for_id(word))
 
-    # Ensure the word exists in history
-    word_doc = word_ref.get()
-    if not word_doc.exists:
-        word_ref.set({
-            'word': word, 'first_explored_at': firestore.SERVER_TIMESTAMP,
-            'last_explored_at': firestore.SERVER_TIMESTAMP, 'is_favorite': False,
-            'modes_generated': ['quiz']
-        }, merge=True)
-    else:
-        word_ref.update({
-            'modes_generated': firestore.ArrayUnion(['quiz']),
-            'last_explored_at': firestore.SERVER_TIMESTAMP
-        })
-    
     # Update user's aggregate stats
     user_update_payload = {'total_quiz_questions_answered': firestore.Increment(1)}
     if is_correct:
         user_update_payload['total_quiz_questions_correct'] = firestore.Increment(1)
         user_update_payload['quiz_points'] = firestore.Increment(10)
-    
-    user_ref.update(user_update_payload)
+
+    batch = db.batch()
+    batch.update(word_ref, {
+        'modes_generated': firestore.ArrayUnion(['quiz']),
+        'last_explored_at': firestore.SERVER_TIMESTAMP
+    })
+    batch.update(user_ref, user_update_payload)
+    try:
+        batch.commit()
+        return
+    except NotFound:
+        pass
+
+    # First attempt on this word: create its history entry alongside the rest.
+    # The user update in the same batch fails with NotFound if the account is
+    # gone, so no entry is left behind under a deleted user.
+    batch = db.batch()
+    batch.set(word_ref, {
+        'word': word, 'first_explored_at': firestore.SERVER_TIMESTAMP,
+        'last_explored_at': firestore.SERVER_TIMESTAMP, 'is_favorite': False,
+        'modes_generated': firestore.ArrayUnion(['quiz'])
+    }, merge=True)
+    batch.update(user_ref, user_update_payload)
+    batch.commit()
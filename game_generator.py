@@ -4,10 +4,13 @@ import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import logging
 import json
+import orjson
 import re
 import random
 from urllib.parse import quote
 
+GAME_SAFETY_SETTINGS = {HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE}
+
 # --- Asset Management Logic (Integrated) ---
 
 # The base URL for your raw GitHub content.
@@ -231,19 +234,25 @@ GAME_HTML_TEMPLATE = """
 </html>
 """
 
+# Patterns for pulling the game metadata out of the AI's response, compiled once.
+_TITLE_RE = re.compile(r"Game Title:\s*(.*)")
+_INSTRUCTIONS_RE = re.compile(r"Game Instructions:\s*(.*)")
+_CORRECT_ITEMS_RE = re.compile(r"Correct Items:\s*(\[.*?\])", re.DOTALL)
+_INCORRECT_ITEMS_RE = re.compile(r"Incorrect Items:\s*(\[.*?\])", re.DOTALL)
+
 def parse_ai_reasoning(reasoning_text: str):
     """Parses the reasoning text from the AI to extract game metadata."""
-    title_match = re.search(r"Game Title:\s*(.*)", reasoning_text)
-    instructions_match = re.search(r"Game Instructions:\s*(.*)", reasoning_text)
-    correct_match = re.search(r"Correct Items:\s*(\[.*?\])", reasoning_text, re.DOTALL)
-    incorrect_match = re.search(r"Incorrect Items:\s*(\[.*?\])", reasoning_text, re.DOTALL)
+    title_match = _TITLE_RE.search(reasoning_text)
+    instructions_match = _INSTRUCTIONS_RE.search(reasoning_text)
+    correct_match = _CORRECT_ITEMS_RE.search(reasoning_text)
+    incorrect_match = _INCORRECT_ITEMS_RE.search(reasoning_text)
 
     title = title_match.group(1).strip() if title_match else "Tiny Tutor Game"
     instructions = instructions_match.group(1).strip() if instructions_match else "Tap the correct items!"
     
     try:
-        correct_items = json.loads(correct_match.group(1)) if correct_match else []
-        incorrect_items = json.loads(incorrect_match.group(1)) if incorrect_match else []
+        correct_items = orjson.loads(correct_match.group(1)) if correct_match else []
+        incorrect_items = orjson.loads(incorrect_match.group(1)) if incorrect_match else []
     except (json.JSONDecodeError, AttributeError):
         correct_items = []
         incorrect_items = []
@@ -256,10 +265,10 @@ def generate_game_for_topic(topic: str):
     try:
         prompt = PROMPT_TEMPLATE.replace("TOPIC_PLACEHOLDER", topic)
 
-        gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        safety_settings = {HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE}
-        
-        response = gemini_model.generate_content(prompt, safety_settings=safety_settings)
+        # A GenerativeModel keeps the API key it first ran with, and the key is
+        # configured per request, so the model is built per request too.
+        gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest', safety_settings=GAME_SAFETY_SETTINGS)
+        response = gemini_model.generate_content(prompt)
         reasoning_text = response.text.strip()
         
         title, instructions, correct_items, incorrect_items = parse_ai_reasoning(reasoning_text)
@@ -272,11 +281,11 @@ def generate_game_for_topic(topic: str):
 
         final_html = GAME_HTML_TEMPLATE.format(
             title=title,
-            assets_json=json.dumps(asset_urls),
-            correct_items_json=json.dumps(correct_items),
-            incorrect_items_json=json.dumps(incorrect_items),
-            title_json=json.dumps(title),
-            instructions_json=json.dumps(instructions)
+            assets_json=orjson.dumps(asset_urls).decode('utf-8'),
+            correct_items_json=orjson.dumps(correct_items).decode('utf-8'),
+            incorrect_items_json=orjson.dumps(incorrect_items).decode('utf-8'),
+            title_json=orjson.dumps(title).decode('utf-8'),
+            instructions_json=orjson.dumps(instructions).decode('utf-8')
         )
         
         return reasoning_text, final_html
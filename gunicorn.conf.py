@@ -0,0 +1,30 @@
+# gunicorn.conf.py
+# Every route is IO-bound on Firestore/Gemini/external APIs, so a few workers
+# that each keep many requests in flight beat a larger pool of sync workers.
+# GUNICORN_WORKER_CLASS=gthread (or -k gthread) switches to real threads, which
+# post_fork leaves unpatched; the module-level Firestore client is thread-safe
+# and shares its gRPC channel.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_connections = 1000  # gevent: concurrent greenlets per worker
+threads = int(os.environ.get('GUNICORN_THREADS', 32))  # gthread: threads per worker
+timeout = 120
+# The Firestore/Gemini gRPC channels aren't fork-safe: each worker must import the
+# app (and open its own channels) after forking, so never preload in the master.
+preload_app = False
+
+def post_fork(server, worker):
+    # Runs in each worker before it imports the app, whatever the app path
+    # (wsgi:app or app:app). gevent workers need the stdlib patched and gRPC
+    # moved onto gevent's IO first, or Firestore calls block the hub.
+    if type(worker).__module__ != 'gunicorn.workers.ggevent':
+        return
+    from gevent import monkey
+    monkey.patch_all()
+
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()
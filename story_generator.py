@@ -4,6 +4,8 @@ import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import logging
 import json
+import orjson
+import fastjsonschema
 
 # The prompt for generating a single turn of the story remains here.
 BASE_PROMPT = """
@@ -82,6 +84,19 @@ STORY_NODE_SCHEMA = {
 }
 
 
+# Code-generated validator for parsed nodes, compiled once from the same schema.
+validate_story_node = fastjsonschema.compile(STORY_NODE_SCHEMA)
+
+# Identical for every request, so built once; the model itself is not (see generate_story_node).
+STORY_GENERATION_CONFIG = genai.types.GenerationConfig(response_mime_type="application/json", response_schema=STORY_NODE_SCHEMA)
+STORY_SAFETY_SETTINGS = {
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+}
+
+
 def generate_story_node(topic: str, history: list, last_choice_leads_to: str, language: str = 'en'):
     """
     Generates a single story node by calling the Gemini API.
@@ -96,10 +111,11 @@ def generate_story_node(topic: str, history: list, last_choice_leads_to: str, la
         A dictionary representing the parsed JSON of the story node.
     
     Raises:
-        ValueError: If the API response is blocked or returns unreadable JSON.
+        ValueError: If the API response is blocked, returns unreadable JSON,
+            or doesn't match STORY_NODE_SCHEMA.
         Exception: For other, more general API or network errors.
     """
-    history_str = json.dumps(history, indent=2)
+    history_str = orjson.dumps(history, option=orjson.OPT_INDENT_2).decode('utf-8')
     
     prompt_to_send = (
         f"{BASE_PROMPT.format(topic=topic, language=language)}\n\n"
@@ -111,33 +127,28 @@ def generate_story_node(topic: str, history: list, last_choice_leads_to: str, la
     )
 
     try:
-        # **FIX:** Instantiate the GenerativeModel *before* calling generate_content.
-        gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        
-        generation_config = genai.types.GenerationConfig(response_mime_type="application/json", response_schema=STORY_NODE_SCHEMA)
-        safety_settings = {
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-        }
-        
-        # Now, call the method on the 'gemini_model' object.
-        response = gemini_model.generate_content(
-            prompt_to_send,
-            generation_config=generation_config,
-            safety_settings=safety_settings
+        # A GenerativeModel keeps the API key it first ran with, and the key is
+        # configured per request, so the model is built per request too.
+        gemini_model = genai.GenerativeModel(
+            'gemini-1.5-flash-latest',
+            generation_config=STORY_GENERATION_CONFIG,
+            safety_settings=STORY_SAFETY_SETTINGS
         )
+        response = gemini_model.generate_content(prompt_to_send)
 
         if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
              raise ValueError(f"Prompt blocked for safety reasons: {response.prompt_feedback.block_reason}")
 
-        parsed_node = json.loads(response.text)
+        parsed_node = orjson.loads(response.text)
+        validate_story_node(parsed_node)
         return parsed_node
 
     except json.JSONDecodeError as e:
         logging.error(f"JSONDecodeError in story_generator: Could not parse AI response. Error: {e}")
         raise ValueError("AI returned unreadable JSON format.")
+    except fastjsonschema.JsonSchemaException as e:
+        logging.error(f"Story node failed schema validation: {e.message}")
+        raise ValueError(f"AI returned a malformed story node: {e.message}")
     except Exception as e:
         logging.error(f"A general error occurred in story_generator: {e}")
         raise
@@ -0,0 +1,7 @@
+# tests/conftest.py
+# The app modules live at the repo root; make them importable from the tests.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
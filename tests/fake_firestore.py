@@ -0,0 +1,207 @@
+# tests/fake_firestore.py
+# In-memory stand-in for the slice of the Firestore client the handlers use:
+# document/collection refs, get_all, simple queries (==, >, order_by, limit,
+# start_after, count), batches and transactions. Docs live in one dict keyed by path.
+
+import uuid
+
+from google.api_core.exceptions import Conflict, NotFound
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data[field]
+
+
+class FakeDocRef:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return FakeCollection(self._db, self.path.rsplit('/', 1)[0])
+
+    def collection(self, name):
+        return FakeCollection(self._db, f"{self.path}/{name}")
+
+    def collections(self):
+        prefix = self.path + '/'
+        names = {p[len(prefix):].split('/', 1)[0] for p in self._db.docs if p.startswith(prefix)}
+        return [self.collection(name) for name in sorted(names)]
+
+    def get(self, field_paths=None, transaction=None):
+        return FakeSnapshot(self, self._db.docs.get(self.path))
+
+    def set(self, data, merge=False):
+        if merge and self.path in self._db.docs:
+            self._db.docs[self.path].update(data)
+        else:
+            self._db.docs[self.path] = dict(data)
+
+    def update(self, data):
+        if self.path not in self._db.docs:
+            raise NotFound(f"No document to update: {self.path}")
+        self._db.docs[self.path].update(data)
+
+    def create(self, data):
+        if self.path in self._db.docs:
+            raise Conflict(f"Document already exists: {self.path}")
+        self._db.docs[self.path] = dict(data)
+
+    def delete(self):
+        self._db.docs.pop(self.path, None)
+
+
+class FakeCount:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeAggregation:
+    def __init__(self, query):
+        self._query = query
+
+    def get(self):
+        return [[FakeCount(len(self._query._matching()))]]
+
+
+class FakeQuery:
+    def __init__(self, db, path, filters=(), order=None, cursor=None, limit=None):
+        self._db = db
+        self._path = path
+        self._filters = tuple(filters)
+        self._order = order
+        self._cursor = cursor
+        self._limit = limit
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, order=self._order, cursor=self._cursor, limit=self._limit)
+        state.update(changes)
+        return FakeQuery(self._db, self._path, **state)
+
+    def where(self, filter):
+        return self._copy(filters=self._filters + (filter,))
+
+    def select(self, field_paths):
+        return self
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(order=(field, direction))
+
+    def start_after(self, snapshot):
+        return self._copy(cursor=snapshot)
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def count(self):
+        return FakeAggregation(self)
+
+    def _matches(self, data, field_filter):
+        value = data.get(field_filter.field_path)
+        if field_filter.op_string == '==':
+            return value == field_filter.value
+        if field_filter.op_string == '>':
+            # Firestore only compares values of the same type
+            return type(value) is type(field_filter.value) and value > field_filter.value
+        raise NotImplementedError(field_filter.op_string)
+
+    def _matching(self):
+        prefix = self._path + '/'
+        snapshots = [
+            FakeSnapshot(FakeDocRef(self._db, path), data)
+            for path, data in self._db.docs.items()
+            if path.startswith(prefix) and '/' not in path[len(prefix):]
+            and all(self._matches(data, f) for f in self._filters)
+        ]
+        if self._order:
+            field, direction = self._order
+            descending = direction == 'DESCENDING'
+            snapshots = [s for s in snapshots if field in s._data]
+            snapshots.sort(key=lambda s: s._data[field], reverse=descending)
+            if self._cursor is not None:
+                bound = self._cursor._data[field]
+                snapshots = [s for s in snapshots if (s._data[field] < bound if descending else s._data[field] > bound)]
+        if self._limit is not None:
+            snapshots = snapshots[:self._limit]
+        return snapshots
+
+    def stream(self, transaction=None):
+        return iter(self._matching())
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, doc_id=None):
+        return FakeDocRef(self._db, f"{self._path}/{doc_id or uuid.uuid4().hex}")
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class FakeBatch:
+    """Applies its writes on commit, all or none."""
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(('set', ref, data, merge))
+
+    def update(self, ref, data):
+        self._writes.append(('update', ref, data, None))
+
+    def delete(self, ref):
+        self._writes.append(('delete', ref, None, None))
+
+    def commit(self):
+        for op, ref, _, _ in self._writes:
+            if op == 'update' and ref.path not in self._db.docs:
+                raise NotFound(f"No document to update: {ref.path}")
+        for op, ref, data, merge in self._writes:
+            if op == 'set':
+                ref.set(data, merge=merge)
+            elif op == 'update':
+                ref.update(data)
+            else:
+                ref.delete()
+
+
+class FakeTransaction(FakeBatch):
+    """Writes are applied when the test calls commit(), as Firestore does at the end of the function."""
+
+
+class FakeFirestore:
+    def __init__(self, docs=None):
+        self.docs = {path: dict(data) for path, data in (docs or {}).items()}
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def get_all(self, refs, field_paths=None, transaction=None):
+        return [ref.get() for ref in refs]
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def transaction(self):
+        return FakeTransaction(self)
@@ -0,0 +1,51 @@
+# tests/test_account_deletion.py
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+
+import app as app_module
+from fake_firestore import FakeFirestore
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = FakeFirestore({
+        'users/u1': {'username_lowercase': 'jane doe', 'email': 'jane@example.com', 'tier': 'pro'},
+        'users/u1/word_history/w': {'word': 'w'},
+        'username_index/jane doe': {'uid': 'u1'},
+        'email_index/jane@example.com': {'uid': 'u1'},
+    })
+    monkeypatch.setattr(app_module, 'db', db)
+    monkeypatch.setattr(app_module, 'users_collection', db.collection('users'))
+    return db
+
+
+def _auth_header(user_id):
+    token = jwt.encode(
+        {'user_id': user_id, 'exp': datetime.now(timezone.utc) + timedelta(minutes=5)},
+        app_module.app.config['JWT_SECRET_KEY'], algorithm='HS256'
+    )
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_delete_account_removes_data_and_evicts_caches(fake_db):
+    with app_module._taken_identifier_cache_lock:
+        app_module._taken_identifier_cache[('username', 'jane doe')] = "Username already exists"
+        app_module._taken_identifier_cache[('email', 'jane@example.com')] = "Email already registered"
+
+    response = app_module.app.test_client().post('/delete_account', headers=_auth_header('u1'))
+
+    assert response.status_code == 200
+    assert fake_db.docs == {}
+    assert ('username', 'jane doe') not in app_module._taken_identifier_cache
+    assert ('email', 'jane@example.com') not in app_module._taken_identifier_cache
+    # The request itself cached the tier; deletion must not leave it behind
+    assert 'u1' not in app_module._user_tier_cache
+
+
+def test_token_of_deleted_account_is_refused_after_eviction(fake_db):
+    client = app_module.app.test_client()
+    headers = _auth_header('u1')
+    assert client.post('/delete_account', headers=headers).status_code == 200
+    assert client.get('/profile', headers=headers).status_code == 401
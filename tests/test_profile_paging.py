@@ -0,0 +1,68 @@
+# tests/test_profile_paging.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from fake_firestore import FakeFirestore
+from firestore_handler import PageCursorNotFoundError, get_user_profile_data
+
+_BASE_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _user_db(tier='pro'):
+    docs = {'users/u1': {'username': 'jane', 'email': 'jane@example.com', 'tier': tier, 'created_at': _BASE_TIME}}
+    for i in range(5):
+        docs[f'users/u1/word_history/w{i}'] = {
+            'word': f'word {i}', 'is_favorite': i == 1,
+            'last_explored_at': _BASE_TIME + timedelta(minutes=i), 'first_explored_at': _BASE_TIME,
+        }
+    # Entries without a word are neither listed nor counted
+    docs['users/u1/word_history/blank'] = {'word': '', 'last_explored_at': _BASE_TIME - timedelta(days=1)}
+    docs['users/u1/streaks/s1'] = {'words': ['word 0'], 'score': 1, 'completed_at': _BASE_TIME}
+    return FakeFirestore(docs)
+
+
+def _ids(entries):
+    return [entry['id'] for entry in entries]
+
+
+def test_first_page_carries_totals_favorites_and_streaks():
+    profile = get_user_profile_data(_user_db(), 'u1', 2)
+    assert _ids(profile['exploredWords']) == ['w4', 'w3']
+    assert profile['exploredWordsNextCursor'] == 'w3'
+    assert profile['totalWordsExplored'] == 5
+    assert _ids(profile['favoriteWords']) == ['w1']
+    assert _ids(profile['streakHistory']) == ['s1']
+
+
+def test_later_pages_only_carry_the_next_slice():
+    db = _user_db()
+    profile = get_user_profile_data(db, 'u1', 2, 'w3')
+    assert _ids(profile['exploredWords']) == ['w2', 'w1']
+    assert profile['exploredWordsNextCursor'] == 'w1'
+    for key in ('totalWordsExplored', 'favoriteWords', 'streakHistory'):
+        assert key not in profile
+
+
+def test_paging_ends_with_a_null_cursor():
+    db = _user_db()
+    seen, cursor = [], None
+    for _ in range(10):
+        profile = get_user_profile_data(db, 'u1', 2, cursor)
+        seen += _ids(profile['exploredWords'])
+        cursor = profile['exploredWordsNextCursor']
+        if cursor is None:
+            break
+    assert cursor is None
+    assert seen == ['w4', 'w3', 'w2', 'w1', 'w0']
+
+
+def test_unknown_cursor_is_rejected_instead_of_restarting():
+    with pytest.raises(PageCursorNotFoundError):
+        get_user_profile_data(_user_db(), 'u1', 2, 'missing')
+
+
+def test_free_users_get_no_word_lists():
+    profile = get_user_profile_data(_user_db(tier='free'), 'u1', 2)
+    assert profile['exploredWords'] == [] and profile['totalWordsExplored'] == 0
+    assert 'exploredWordsNextCursor' not in profile
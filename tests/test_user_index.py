@@ -0,0 +1,81 @@
+# tests/test_user_index.py
+import pytest
+
+from fake_firestore import FakeFirestore
+from firestore_handler import (
+    IdentifierTakenError,
+    _create_user_in_transaction,
+    backfill_user_indexes,
+    find_user_id_by_identifier,
+)
+
+JANE = {'username': 'Jane Doe', 'username_lowercase': 'jane doe', 'email': 'jane@example.com'}
+
+
+def _create_user(db, **overrides):
+    # Runs the transaction body directly; the fake applies its writes on commit
+    transaction = db.transaction()
+    user_id = _create_user_in_transaction.to_wrap(transaction, db, {**JANE, **overrides})
+    transaction.commit()
+    return user_id
+
+
+def test_signup_writes_user_and_both_sentinels():
+    db = FakeFirestore()
+    user_id = _create_user(db)
+    assert db.docs[f'users/{user_id}']['email'] == 'jane@example.com'
+    assert db.docs['username_index/jane doe'] == {'uid': user_id}
+    assert db.docs['email_index/jane@example.com'] == {'uid': user_id}
+
+
+@pytest.mark.parametrize('field, overrides', [
+    ('username', {'email': 'other@example.com'}),
+    ('email', {'username': 'Someone', 'username_lowercase': 'someone'}),
+])
+def test_signup_rejects_identifier_held_by_a_sentinel(field, overrides):
+    db = FakeFirestore()
+    _create_user(db)
+    with pytest.raises(IdentifierTakenError) as excinfo:
+        _create_user(db, **overrides)
+    assert excinfo.value.field == field
+
+
+@pytest.mark.parametrize('field, overrides', [
+    ('username', {'email': 'other@example.com'}),
+    ('email', {'username': 'Someone', 'username_lowercase': 'someone'}),
+])
+def test_signup_rejects_identifier_of_legacy_account_without_sentinel(field, overrides):
+    db = FakeFirestore({'users/legacy': dict(JANE)})
+    with pytest.raises(IdentifierTakenError) as excinfo:
+        _create_user(db, **overrides)
+    assert excinfo.value.field == field
+    assert list(db.docs) == ['users/legacy']
+
+
+def test_login_resolves_through_the_sentinel():
+    db = FakeFirestore()
+    user_id = _create_user(db)
+    assert find_user_id_by_identifier(db, 'JANE DOE') == user_id
+    assert find_user_id_by_identifier(db, 'Jane@Example.com') == user_id
+
+
+def test_login_finds_legacy_account_and_claims_its_sentinel():
+    db = FakeFirestore({'users/legacy': dict(JANE)})
+    assert find_user_id_by_identifier(db, 'jane@example.com') == 'legacy'
+    assert db.docs['email_index/jane@example.com'] == {'uid': 'legacy'}
+
+
+@pytest.mark.parametrize('identifier', ['.', '..', '__x__', 'a/b', 'x' * 1501, 'nobody'])
+def test_login_lookup_without_a_match_returns_none(identifier):
+    assert find_user_id_by_identifier(FakeFirestore(), identifier) is None
+
+
+def test_backfill_skips_values_firestore_refuses_as_ids():
+    db = FakeFirestore({
+        'users/a': dict(JANE),
+        'users/b': {'username_lowercase': '__b__', 'email': 'b@example.com'},
+    })
+    assert backfill_user_indexes(db) == 3
+    assert db.docs['username_index/jane doe'] == {'uid': 'a'}
+    assert db.docs['email_index/b@example.com'] == {'uid': 'b'}
+    assert 'username_index/__b__' not in db.docs
@@ -1,5 +1,6 @@
 import google.generativeai as genai
 import json
+import orjson
 import logging
 import os
 import requests
@@ -16,7 +17,7 @@ def get_routed_web_context(query: str, model: genai.GenerativeModel):
     """
     try:
         intent, entity = _get_intent_from_query(query, model)
-        logging.warning(f"AGENT LOG: Intent recognized for query '{query}' -> INTENT: {intent}, ENTITY: {entity}")
+        logging.debug("AGENT LOG: Intent recognized for query '%s' -> INTENT: %s, ENTITY: %s", query, intent, entity)
     except Exception as e:
         logging.error(f"Could not determine intent for query '{query}': {e}. Using fallback.")
         intent, entity = "FALLBACK_SEARCH", query
@@ -26,27 +27,27 @@ def get_routed_web_context(query: str, model: genai.GenerativeModel):
     is_fallback_search = True 
 
     if intent == "NEWS":
-        logging.warning(f"--- Routing to NEWS API for entity: {entity} ---")
+        logging.debug("--- Routing to NEWS API for entity: %s ---", entity)
         results = _call_news_api(entity)
         is_fallback_search = False
     elif intent == "VIDEO":
-        logging.warning(f"--- Routing to YOUTUBE API for entity: {entity} ---")
+        logging.debug("--- Routing to YOUTUBE API for entity: %s ---", entity)
         results = _call_youtube_api(entity)
         is_fallback_search = False
     elif intent == "KNOWLEDGE":
-        logging.warning(f"--- Routing to WIKIPEDIA API for entity: {entity} ---")
+        logging.debug("--- Routing to WIKIPEDIA API for entity: %s ---", entity)
         results = _call_wikipedia_api(entity)
         is_fallback_search = False
     elif intent == "EVENTS":
-        logging.warning(f"--- Routing to TICKETMASTER API for entity: {entity} ---")
+        logging.debug("--- Routing to TICKETMASTER API for entity: %s ---", entity)
         results = _call_ticketmaster_api(entity)
         is_fallback_search = False
     elif intent == "FINANCE":
-        logging.warning(f"--- Routing to ALPHA VANTAGE API for entity: {entity} ---")
+        logging.debug("--- Routing to ALPHA VANTAGE API for entity: %s ---", entity)
         results = _call_alphavantage_api(entity)
         is_fallback_search = False
     elif intent == "TRAVEL_HOTELS":
-        logging.warning(f"--- Routing to HOTELS API for entity: {entity} ---")
+        logging.debug("--- Routing to HOTELS API for entity: %s ---", entity)
         results = _call_hotels_api(entity)
         is_fallback_search = False
     
@@ -57,7 +58,7 @@ def get_routed_web_context(query: str, model: genai.GenerativeModel):
         return _perform_google_search(query, intent, entity)
     # If the initial intent was already a fallback search, just run it.
     elif is_fallback_search:
-        logging.warning(f"--- Routing to INTELLIGENT FALLBACK for query: {query} ---")
+        logging.debug("--- Routing to INTELLIGENT FALLBACK for query: %s ---", query)
         return _perform_google_search(query, intent, entity)
     # Otherwise, return the successful results from the specific tool.
     else:
@@ -97,7 +98,7 @@ def _get_intent_from_query(query: str, model: genai.GenerativeModel):
     
     response = model.generate_content(prompt)
     try:
-        analysis = json.loads(response.text.strip())
+        analysis = orjson.loads(response.text.strip())
         return analysis.get("intent"), analysis.get("entity")
     except json.JSONDecodeError:
         logging.error(f"Failed to decode JSON from intent recognition for query: '{query}'. Defaulting to fallback.")
@@ -178,13 +179,13 @@ def _call_ticketmaster_api(entity: str):
 
     url = f"https://app.ticketmaster.com/discovery/v2/events.json?apikey={api_key}&keyword={quote_plus(entity)}&size=5"
     try:
-        logging.warning(f"--- Calling Ticketmaster API for entity: {entity} ---")
+        logging.debug("--- Calling Ticketmaster API for entity: %s ---", entity)
         response = requests.get(url, timeout=25)
         response.raise_for_status()
 
         events = response.json().get('_embedded', {}).get('events', [])
         
-        logging.warning(f"--- Found {len(events)} events in Ticketmaster response. ---")
+        logging.debug("--- Found %s events in Ticketmaster response. ---", len(events))
         if not events:
             return []
 
@@ -259,7 +260,7 @@ def _call_hotels_api(entity: str):
     }
 
     try:
-        logging.warning(f"--- Calling Tripadvisor Scraper Hotel API for entity: {entity} ---")
+        logging.debug("--- Calling Tripadvisor Scraper Hotel API for entity: %s ---", entity)
         response = requests.get(url, headers=headers, params=params, timeout=25)
         response.raise_for_status()
         
@@ -274,7 +275,7 @@ def _call_hotels_api(entity: str):
             logging.warning(f"No hotel results found after filtering for city: {entity}")
             return []
 
-        logging.warning(f"--- Success! Normalizing {len(hotels)} hotel results from Tripadvisor Scraper. ---")
+        logging.debug("--- Success! Normalizing %s hotel results from Tripadvisor Scraper. ---", len(hotels))
         normalized_results = []
         for hotel in hotels[:5]: # Take the first 5 results
             
@@ -320,7 +321,6 @@ def _perform_google_search(original_query: str, intent: str, entity: str):
     query optimization prompt.
     """
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
         query_optimizer_prompt = f"""
         You are a Google Search query optimization expert. Your task is to take a user's original query, their inferred 'intent', and the key 'entity', and generate a single, highly precise Google search query string.
 
@@ -342,9 +342,11 @@ def _perform_google_search(original_query: str, intent: str, entity: str):
 
         Based on the user's request, what is the single best, optimized search query string?
         """
-        response = model.generate_content(query_optimizer_prompt)
+        # Per call, so it runs with the API key configured for this request
+        query_optimizer_model = genai.GenerativeModel('gemini-1.5-flash-latest')
+        response = query_optimizer_model.generate_content(query_optimizer_prompt)
         optimized_query = response.text.strip()
-        logging.warning(f"--- Optimized Google Search query: '{optimized_query}' ---")
+        logging.debug("--- Optimized Google Search query: '%s' ---", optimized_query)
     except Exception as e:
         logging.error(f"Failed to generate optimized query: {e}. Using original query.")
         optimized_query = original_query
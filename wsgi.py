@@ -0,0 +1,6 @@
+# wsgi.py
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+# gevent workers are monkey-patched by the post_fork hook in gunicorn.conf.py,
+# which checks the worker class actually running, so this module only exposes the app.
+
+from app import app  # noqa: F401